@@ -56,6 +56,15 @@ class AppConfig(BaseSettings):
         1,
         description='Number of workers for faster-whisper'
     )
+    max_concurrent_transcriptions: int = Field(
+        2,
+        ge=1,
+        description='Maximum number of asset transcriptions running at once'
+    )
+    rag_min_query_chars: int = Field(
+        0,
+        description='Minimum query length to run retrieval for RAG endpoints, 0 to always run it'
+    )
     huggingface_hub_token: Optional[str] = Field(
         None,
         description='HF Hub token for model downloads'
@@ -3,14 +3,42 @@ Blueprint definition for assets processing endpoints.
 """
 
 import asyncio
-from quart import Blueprint, request, jsonify
+from quart import Blueprint, request
 
+from siyuan_ai_companion.consts import APP_CONFIG
 from siyuan_ai_companion.model import Transcriber, SiyuanApi
-from .utils import token_required, error_handler
+from .utils import token_required, error_handler, ojsonify
 
 
 asset_blueprint = Blueprint('transcribe', __name__)
 
+# Limit the number of transcriptions running at once, each one holds its own models
+_TRANSCRIBE_SEM = asyncio.Semaphore(APP_CONFIG.max_concurrent_transcriptions)
+# Keep references to the background tasks so they are not garbage collected
+_TASKS: set[asyncio.Task] = set()
+# SiYuan client shared by all requests, opened for the lifetime of the server
+_SIYUAN_SINGLETON: SiyuanApi | None = None
+
+
+@asset_blueprint.before_app_serving
+async def open_siyuan_client():
+    """
+    Open the shared SiYuan client when the application starts serving.
+    """
+    global _SIYUAN_SINGLETON   # pylint: disable=global-statement
+
+    _SIYUAN_SINGLETON = SiyuanApi()
+    await _SIYUAN_SINGLETON.__aenter__()
+
+
+@asset_blueprint.after_app_serving
+async def close_siyuan_client():
+    """
+    Close the shared SiYuan client when the application shuts down.
+    """
+    if _SIYUAN_SINGLETON is not None:
+        await _SIYUAN_SINGLETON.__aexit__(None, None, None)
+
 
 @asset_blueprint.route('/', methods=['GET'])
 @error_handler
@@ -19,12 +47,11 @@ async def get_assets():
     """
     Get the list of all assets from SiYuan server.
     """
-    async with SiyuanApi() as siyuan:
-        suffixes = request.args.getlist('suffix')
+    suffixes = request.args.getlist('suffix')
 
-        assets = await siyuan.list_assets(suffixes=suffixes)
+    assets = await _SIYUAN_SINGLETON.list_assets(suffixes=suffixes)
 
-    return jsonify({
+    return ojsonify({
         'assets': assets,
     })
 
@@ -36,21 +63,22 @@ async def get_audio_assets():
     """
     Get the list of all audio assets from SiYuan server.
     """
-    async with SiyuanApi() as siyuan:
-        audio_assets = await siyuan.list_assets(suffixes=['wav'])
-        audio_blocks = await siyuan.get_audio_blocks(
-            audio_names=audio_assets,
-        )
-        transcription_ids = await siyuan.get_audio_transcription_ids(
-            audio_ids=list(audio_blocks.values()),
-        )
+    siyuan = _SIYUAN_SINGLETON
 
-        result = {}
+    audio_assets = await siyuan.list_assets(suffixes=['wav'])
+    audio_blocks = await siyuan.get_audio_blocks(
+        audio_names=audio_assets,
+    )
+    transcription_ids = await siyuan.get_audio_transcription_ids(
+        audio_ids=list(audio_blocks.values()),
+    )
 
-        for audio_path in audio_blocks.keys():
-            result[audio_path] = transcription_ids.get(audio_blocks[audio_path])
+    result = {
+        audio_path: transcription_ids.get(block_id)
+        for audio_path, block_id in audio_blocks.items()
+    }
 
-        return jsonify(result)
+    return ojsonify(result)
 
 
 @asset_blueprint.route('/audio/transcribe', methods=['POST'])
@@ -69,14 +97,20 @@ async def transcribe_asset_file():
 
     transcriber = Transcriber()
 
-    asyncio.create_task(transcriber.process_asset(
-        asset_path=asset_path,
-        title=title,
-        t_notebook=notebook_id,
-        t_base_path=base_path,
-    ))
+    async def _run():
+        async with _TRANSCRIBE_SEM:
+            await transcriber.process_asset(
+                asset_path=asset_path,
+                title=title,
+                t_notebook=notebook_id,
+                t_base_path=base_path,
+            )
+
+    task = asyncio.create_task(_run())
+    _TASKS.add(task)
+    task.add_done_callback(_TASKS.discard)
 
-    return jsonify({'status': 'processing'}), 202
+    return ojsonify({'status': 'processing'}, 202)
 
 
 @asset_blueprint.route('/notebooks', methods=['GET'])
@@ -86,10 +120,9 @@ async def list_notebooks():
     """
     Get the list of all notebooks from SiYuan server.
     """
-    async with SiyuanApi() as siyuan:
-        notebooks = await siyuan.list_notebooks()
+    notebooks = await _SIYUAN_SINGLETON.list_notebooks()
 
-    return jsonify({
+    return ojsonify({
         'notebooks': notebooks,
     })
 
@@ -114,11 +147,10 @@ async def save_chat():
         content = message['content']
         chat_content += f'**{role}**: {content}\n\n'
 
-    async with SiyuanApi() as siyuan:
-        await siyuan.create_note(
-            notebook_id=notebook_id,
-            path=chat_title,
-            markdown_content=chat_content,
-        )
+    await _SIYUAN_SINGLETON.create_note(
+        notebook_id=notebook_id,
+        path=chat_title,
+        markdown_content=chat_content,
+    )
 
     return None, 201
@@ -2,19 +2,44 @@
 Blueprint definition for OpenAI compatible API endpoints.
 """
 
-import io
 import asyncio
+import shutil
+from tempfile import SpooledTemporaryFile
 from urllib.parse import urljoin
-from quart import Blueprint, Response, request, jsonify, stream_with_context
+import orjson
+from quart import Blueprint, Response, request, stream_with_context
 
 from siyuan_ai_companion.consts import APP_CONFIG, LOGGER
 from siyuan_ai_companion.model import RagDriver, Transcriber
 from .utils import CompanionEndpointHandlerError, token_required, forward_request, \
-    error_handler
+    forward_raw, error_handler, ojsonify
 
 
 openai_blueprint = Blueprint('openai', __name__)
 
+# Upstream endpoints, the OpenAI URL is fixed for the process lifetime
+_URL_CHAT = urljoin(APP_CONFIG.openai_url, 'chat/completions')
+_URL_COMPLETIONS = urljoin(APP_CONFIG.openai_url, 'completions')
+_URL_EMBEDDINGS = urljoin(APP_CONFIG.openai_url, 'embeddings')
+_URL_MODELS = urljoin(APP_CONFIG.openai_url, 'models')
+
+
+def _worth_rag(query: str) -> bool:
+    """
+    Check if a query is substantial enough to benefit from retrieval
+
+    Greetings and acknowledgements yield no useful context, so they can
+    skip the embedding and vector search entirely. Off unless
+    RAG_MIN_QUERY_CHARS is set, as short questions (especially in CJK
+    languages) would lose their context too.
+    :param query: The user message
+    :return: True if the RAG prompt should be built for the query
+    """
+    if APP_CONFIG.rag_min_query_chars <= 0:
+        return True
+
+    return len(query.strip()) >= APP_CONFIG.rag_min_query_chars and len(set(query)) >= 4
+
 
 @openai_blueprint.route('/rag/v1/chat/completions', methods=['POST'])
 @error_handler
@@ -24,10 +49,10 @@ async def v1_chat_completion_rag():
     Chat completion with automatic RAG prompt injection.
 
     The prompt in this endpoint is expected to be a list of messages.
+    The parsed payload is not cached, and is modified in place to inject
+    the prompt rather than copied.
     """
-    request_payload: dict = await request.get_json()
-
-    user_message = ''
+    request_payload: dict = await request.get_json(force=True, cache=False)
 
     if 'tokenizerModel' in request_payload:
         # Using a third-party model runner like ollama, which does not
@@ -37,28 +62,38 @@ async def v1_chat_completion_rag():
     else:
         chat_model = request_payload.get('model')
 
-    for message in request_payload.get('messages', []):
+    # Locate the first user message (the query) and the last one (the
+    # injection target) in a single pass over the chat history
+    user_message = ''
+    last_user_idx = -1
+
+    for i, message in enumerate(request_payload.get('messages', ())):
         if message.get('role') == 'user':
-            user_message = message.get('content', '')
-            break
+            if last_user_idx == -1:
+                user_message = message.get('content', '')
+            last_user_idx = i
 
     if not user_message:
         raise CompanionEndpointHandlerError('No user message provided', 400)
 
-    rag_driver = RagDriver()
-    rag_driver.selected_model = chat_model
-    new_prompt = await rag_driver.build_prompt(
-        query=user_message,
-    )
+    if _worth_rag(user_message):
+        rag_driver = RagDriver()
+        rag_driver.selected_model = chat_model
+        new_prompt = await rag_driver.build_prompt(
+            query=user_message,
+        )
 
-    # Inject the RAG-generated prompt into the user message
-    for i in reversed(range(len(request_payload['messages']))):
-        if request_payload['messages'][i]['role'] == 'user':
-            request_payload['messages'][i]['content'] = new_prompt
-            break
+        # Inject the RAG-generated prompt into the user message
+        request_payload['messages'][last_user_idx]['content'] = new_prompt
+    else:
+        LOGGER.info('Query too short for retrieval, forwarding without context')
 
-    target_url = urljoin(APP_CONFIG.openai_url, 'chat/completions')
-    return await forward_request(target_url, request_payload)
+    target_url = _URL_CHAT
+    return await forward_request(
+        target_url,
+        request_payload,
+        payload_bytes=orjson.dumps(request_payload),
+    )
 
 
 @openai_blueprint.route('/direct/v1/chat/completions', methods=['POST'])
@@ -70,9 +105,13 @@ async def v1_chat_completion_direct():
 
     The prompt in this endpoint is expected to be a list of messages.
     """
-    request_payload = await request.get_json()
-    target_url = urljoin(APP_CONFIG.openai_url, 'chat/completions')
-    return await forward_request(target_url, request_payload)
+    raw_body = await request.get_data()
+    target_url = _URL_CHAT
+    return await forward_raw(
+        target_url,
+        raw_body,
+        request.headers.get('Content-Type', 'application/json'),
+    )
 
 
 @openai_blueprint.route('/rag/v1/completions', methods=['POST'])
@@ -83,9 +122,10 @@ async def v1_completions_rag():
     Completion with automatic RAG prompt injection.
 
     This is raw completion endpoint which will use the prompt directly with the model,
-    the prompt is expected in `prompt` field of the payload.
+    the prompt is expected in `prompt` field of the payload. The parsed payload
+    is not cached, and is modified in place to inject the prompt rather than copied.
     """
-    request_payload = await request.get_json()
+    request_payload = await request.get_json(force=True, cache=False)
 
     prompt = request_payload.get('prompt')
     if not prompt:
@@ -99,15 +139,22 @@ async def v1_completions_rag():
     else:
         chat_model = request_payload.get('model')
 
-    rag_driver = RagDriver()
-    rag_driver.selected_model = chat_model
-    new_prompt = await rag_driver.build_prompt(
-        query=prompt,
-    )
-    request_payload['prompt'] = new_prompt
+    if _worth_rag(prompt):
+        rag_driver = RagDriver()
+        rag_driver.selected_model = chat_model
+        new_prompt = await rag_driver.build_prompt(
+            query=prompt,
+        )
+        request_payload['prompt'] = new_prompt
+    else:
+        LOGGER.info('Query too short for retrieval, forwarding without context')
 
-    target_url = urljoin(APP_CONFIG.openai_url, 'completions')
-    return await forward_request(target_url, request_payload)
+    target_url = _URL_COMPLETIONS
+    return await forward_request(
+        target_url,
+        request_payload,
+        payload_bytes=orjson.dumps(request_payload),
+    )
 
 
 @openai_blueprint.route('/direct/v1/completions', methods=['POST'])
@@ -119,9 +166,13 @@ async def v1_completions_direct():
     This is raw completion endpoint which will use the prompt directly with the model,
     the prompt is expected in `prompt` field of the payload.
     """
-    request_payload = await request.get_json()
-    target_url = urljoin(APP_CONFIG.openai_url, 'completions')
-    return await forward_request(target_url, request_payload)
+    raw_body = await request.get_data()
+    target_url = _URL_COMPLETIONS
+    return await forward_raw(
+        target_url,
+        raw_body,
+        request.headers.get('Content-Type', 'application/json'),
+    )
 
 
 @openai_blueprint.route('/rag/v1/embeddings', methods=['POST'])
@@ -133,9 +184,13 @@ async def v1_embeddings():
 
     This uses the model embedding directly. No prompts injected
     """
-    request_payload = await request.get_json()
-    target_url = urljoin(APP_CONFIG.openai_url, 'embeddings')
-    return await forward_request(target_url, request_payload)
+    raw_body = await request.get_data()
+    target_url = _URL_EMBEDDINGS
+    return await forward_raw(
+        target_url,
+        raw_body,
+        request.headers.get('Content-Type', 'application/json'),
+    )
 
 
 @openai_blueprint.route('/rag/v1/models', methods=['GET'])
@@ -147,7 +202,7 @@ async def v1_models():
 
     This endpoint returns a model list from the OpenAI API.
     """
-    target_url = urljoin(APP_CONFIG.openai_url, 'models')
+    target_url = _URL_MODELS
     return await forward_request(target_url, None, method='GET')
 
 
@@ -170,7 +225,7 @@ async def v1_retrieve():
         query=user_message,
     )
 
-    return jsonify({'context': context})
+    return ojsonify({'context': context})
 
 
 @openai_blueprint.route('/direct/v1/transcribe', methods=['POST'])
@@ -186,32 +241,62 @@ async def v1_transcribe():
 
     file = request_files['file']
     if file.filename == '':
-        return jsonify({'error': 'No selected file'}), 400
+        return ojsonify({'error': 'No selected file'}, 400)
 
-    file_bytes = file.read()
-    audio_buffer = io.BytesIO(file_bytes)
+    # The uploaded file is closed with the request context, before the
+    # response streams, so copy it into a buffer owned by this handler.
+    # Small uploads stay in memory, larger ones roll over to disk, so the
+    # copy runs in a thread to keep the event loop free
+    audio_buffer = SpooledTemporaryFile(max_size=8 << 20)     # pylint: disable=consider-using-with
+    file.stream.seek(0)
+    await asyncio.to_thread(shutil.copyfileobj, file.stream, audio_buffer)
+    audio_buffer.seek(0)
 
     transcriber = Transcriber()
 
     @stream_with_context
     async def streaming_response():
         async_generator = transcriber.process_buffer(audio_buffer)
+        loop = asyncio.get_running_loop()
+        timed_out = False
+
+        def expire(task: asyncio.Task):
+            nonlocal timed_out
+            timed_out = True
+            task.cancel()
 
         try:
             while True:
+                # Cancel the waiting task if the chunk takes too long. A plain timer
+                # avoids wrapping every chunk into a new task like `wait_for` does
+                timeout_handle = loop.call_later(60, expire, asyncio.current_task())
                 try:
-                    text = await asyncio.wait_for(async_generator.__anext__(), timeout=60)
-                    yield text
-                except asyncio.TimeoutError:
+                    text = await async_generator.__anext__()
+                except StopAsyncIteration:
+                    break
+                except asyncio.CancelledError:
+                    if not timed_out:
+                        raise
+
+                    # The cancellation came from our own timer, so withdraw it.
+                    # Otherwise the task stays marked as cancelling, confusing
+                    # any outer timeout or task group in the server
+                    task = asyncio.current_task()
+                    if hasattr(task, 'uncancel'):
+                        task.uncancel()
+
                     raise CompanionEndpointHandlerError(
                         'Timeout while waiting for transcription chunk',
                         408,
                     )
-                except StopAsyncIteration:
-                    break
+                finally:
+                    timeout_handle.cancel()
+
+                yield text
         finally:
             if hasattr(async_generator, 'aclose'):
                 await async_generator.aclose()
+            audio_buffer.close()
 
     response = Response(
         streaming_response(),
@@ -13,23 +13,38 @@ from quart import Blueprint, send_from_directory, redirect, url_for
 
 ui_blueprint = Blueprint('ui', __name__)
 
+# Resolve the bundled UI directory once, it does not change at runtime
+UI_BASE = Path(str(pkg_resources.files('siyuan_ai_companion.data').joinpath('ui')))
+
+# The Flutter build keeps the same names for its entry points across
+# releases, so the browser must revalidate them to pick up a new UI
+NO_CACHE_FILES = frozenset({
+    'index.html',
+    'flutter.js',
+    'flutter_bootstrap.js',
+    'flutter_service_worker.js',
+    'main.dart.js',
+    'manifest.json',
+    'version.json',
+})
+
 
 @ui_blueprint.route('/<path:filename>', methods=['GET'])
 async def serve_ui(filename: str):
-    try:
-        filename = filename.lstrip('/')
-
-        # Check if the file exists in the package resources
-        with pkg_resources.path('siyuan_ai_companion.data', 'ui') as base_path:
-            full_path = Path(base_path) / filename
-            if not full_path.exists() or not full_path.is_file():
-                raise FileNotFoundError
+    filename = filename.lstrip('/')
 
-            return await send_from_directory(base_path, filename)
-    except FileNotFoundError:
+    # Check if the file exists in the package resources
+    if not (UI_BASE / filename).is_file():
         # If the file is not found, return a 404 error
         return {'error': 'File not found'}, 404
 
+    response = await send_from_directory(UI_BASE, filename)
+
+    if filename in NO_CACHE_FILES:
+        response.headers['Cache-Control'] = 'no-cache'
+
+    return response
+
 
 @ui_blueprint.route('/', methods=['GET'])
 async def ui_redirect():
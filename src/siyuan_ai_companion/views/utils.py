@@ -2,15 +2,39 @@
 Utility functions for Quart request handlers.
 """
 
+import hmac
 from functools import wraps
 from copy import deepcopy
-from quart import Response, request, jsonify
+from quart import Response, request
+from werkzeug.datastructures import Headers
 import httpx
+import orjson
 
 from siyuan_ai_companion.consts import APP_CONFIG, LOGGER
 from siyuan_ai_companion.errors import SiYuanAiCompanionError
 
 
+# The full Authorization header expected from clients, None if authentication is disabled
+EXPECTED_AUTH_HEADER = (
+    f'Bearer {APP_CONFIG.companion_token}'.encode()
+    if APP_CONFIG.companion_token is not None else None
+)
+
+# Connection-level headers that only apply to a single hop, and the content
+# type which is set on the relayed response separately
+_NOT_RELAYED_HEADERS = frozenset({
+    'connection',
+    'keep-alive',
+    'proxy-authenticate',
+    'proxy-authorization',
+    'te',
+    'trailer',
+    'transfer-encoding',
+    'upgrade',
+    'content-type',
+})
+
+
 class CompanionEndpointHandlerError(SiYuanAiCompanionError):
     """
     Custom error class for handling errors in the request handler.
@@ -20,9 +44,102 @@ class CompanionEndpointHandlerError(SiYuanAiCompanionError):
         self.status_code = status_code
 
 
+def ojsonify(obj,
+             status: int = 200,
+             ) -> Response:
+    """
+    Serialise an object into a JSON response with orjson
+
+    This is a faster replacement for `quart.jsonify`, which goes
+    through the standard library encoder.
+    :param obj: The object to serialise
+    :param status: The HTTP status code of the response
+    :return: A Quart response with JSON content
+    """
+    return Response(
+        orjson.dumps(obj),
+        status=status,
+        content_type='application/json',
+    )
+
+
+def _upstream_headers() -> Headers:
+    """
+    Build the headers to send to the OpenAI API from the incoming request
+
+    The companion token is replaced with the OpenAI token, if any, and the
+    original length is dropped as the body may be re-encoded.
+    :return: A copy of the request headers, ready to be forwarded
+    """
+    headers = deepcopy(request.headers)
+
+    if APP_CONFIG.openai_token:
+        # Add the OpenAI token to the headers if it is set
+        headers['Authorization'] = f'Bearer {APP_CONFIG.openai_token}'
+    else:
+        headers.pop('Authorization', None)
+
+    headers.pop('Content-Length', None)
+
+    return headers
+
+
+async def forward_raw(url: str,
+                      raw_body: bytes,
+                      content_type: str,
+                      ) -> Response:
+    """
+    Forwards a request body to the OpenAI API without decoding it.
+
+    The payload is never parsed, so the upstream response is always relayed
+    as a stream. This serves both streamed and buffered responses, as the
+    status code and the upstream response headers are copied, except for
+    the hop-by-hop ones. Connecting and sending must finish within 30
+    seconds, but reading is not limited so long streams are not cut off.
+    :param url: The URL to forward the request to.
+    :param raw_body: The request body, as received from the client.
+    :param content_type: The content type of the request body.
+    :return: A Response object streaming the upstream response.
+    """
+    headers = _upstream_headers()
+    headers['Content-Type'] = content_type
+    # Raw bytes are passed through untouched, so the upstream must not
+    # compress the response
+    headers['Accept-Encoding'] = 'identity'
+
+    client = httpx.AsyncClient(timeout=httpx.Timeout(30.0, read=None))
+    try:
+        upstream = await client.send(
+            client.build_request('POST', url, content=raw_body, headers=headers),
+            stream=True,
+        )
+    except httpx.HTTPError:
+        await client.aclose()
+        raise
+
+    async def async_stream():
+        try:
+            async for chunk in upstream.aiter_raw():
+                yield chunk
+        finally:
+            await upstream.aclose()
+            await client.aclose()
+
+    return Response(
+        async_stream(),
+        status=upstream.status_code,
+        headers=[
+            (key, value) for key, value in upstream.headers.multi_items()
+            if key.lower() not in _NOT_RELAYED_HEADERS
+        ],
+        content_type=upstream.headers.get('Content-Type', 'application/json'),
+    )
+
+
 async def forward_request(url: str,
                           payload: dict | None,
                           method='POST',
+                          payload_bytes: bytes | None = None,
                           ) -> tuple[str, int, list[tuple[str, str]]] | Response:
     """
     Forwards the request to the OpenAI API and returns the response.
@@ -31,17 +148,20 @@ async def forward_request(url: str,
     :param url: The URL to forward the request to.
     :param payload: The payload to send in the request.
     :param method: The HTTP method to use (default is POST).
+    :param payload_bytes: The payload already serialised as JSON. If given, it
+                          is sent as the request body instead of encoding
+                          `payload` again.
     :return: The response from the OpenAI API. If streaming response is enabled,
              it returns a Response object for streaming. Otherwise it unpacks the
              response into Quart handler response format.
     """
-    headers = deepcopy(request.headers)
+    headers = _upstream_headers()
 
-    if APP_CONFIG.openai_token:
-        # Add the OpenAI token to the headers if it is set
-        headers['Authorization'] = f'Bearer {APP_CONFIG.openai_token}'
+    if payload_bytes is not None:
+        headers['Content-Type'] = 'application/json'
+        body = {'content': payload_bytes}
     else:
-        headers.pop('Authorization')
+        body = {'json': payload if method == 'POST' else None}
 
     # Detect if the client wants a streamed response
     stream = False
@@ -49,10 +169,14 @@ async def forward_request(url: str,
         stream = payload.get("stream", False)
 
     if stream:
+        # Raw bytes are passed through untouched, so the upstream must not
+        # compress the event stream
+        headers['Accept-Encoding'] = 'identity'
+
         async def async_stream():
             async with httpx.AsyncClient(timeout=None) as c:
-                async with c.stream(method, url, json=payload, headers=headers) as r:
-                    async for chunk in r.aiter_bytes():
+                async with c.stream(method, url, headers=headers, **body) as r:
+                    async for chunk in r.aiter_raw():
                         yield chunk
 
         return Response(async_stream(), content_type='text/event-stream')
@@ -61,9 +185,9 @@ async def forward_request(url: str,
         response = await client.request(
             method=method,
             url=url,
-            json=payload if method == 'POST' else None,
             headers=headers,
             timeout=30.0,
+            **body,
         )
 
     return response.text, response.status_code, response.headers.items()
@@ -75,16 +199,17 @@ def token_required(f):
     """
     @wraps(f)
     async def decorated(*args, **kwargs):
-        if APP_CONFIG.companion_token is None:
+        if EXPECTED_AUTH_HEADER is None:
             # No token set, authentication disabled
             return await f(*args, **kwargs)
 
         token_header = request.headers.get('Authorization', None)
         if not token_header:
-            return jsonify({'error': 'Authorization header is missing'}), 401
+            return ojsonify({'error': 'Authorization header is missing'}, 401)
 
-        if token_header.split(' ')[1] != APP_CONFIG.companion_token:
-            return jsonify({'error': 'Invalid companion token'}), 401
+        # Constant-time comparison to avoid leaking the token through timing
+        if not hmac.compare_digest(token_header.encode(), EXPECTED_AUTH_HEADER):
+            return ojsonify({'error': 'Invalid companion token'}, 401)
 
         return await f(*args, **kwargs)
 
@@ -101,9 +226,9 @@ def error_handler(f):
             return await f(*args, **kwargs)
         except SiYuanAiCompanionError as e:
             LOGGER.error('Error: %s', e.message)
-            return jsonify({'error': e.message}), e.status_code
+            return ojsonify({'error': e.message}, e.status_code)
         except Exception as e:
             LOGGER.error('Unexpected error: %s', str(e))
-            return jsonify({'error': str(e)}), 500
+            return ojsonify({'error': str(e)}, 500)
 
     return decorated
@@ -0,0 +1,16 @@
+import pytest
+from pytest_asyncio import is_async_test
+
+
+def pytest_collection_modifyitems(items):
+    """
+    Run every async test in the session event loop
+
+    Creating a new loop per test is pure overhead, as the async tests
+    do not rely on loop isolation.
+    """
+    session_loop = pytest.mark.asyncio(loop_scope='session')
+
+    for item in items:
+        if is_async_test(item):
+            item.add_marker(session_loop, append=False)
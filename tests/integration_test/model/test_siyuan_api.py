@@ -1,16 +1,45 @@
 import os
 import datetime
 import pytest
+import pytest_asyncio
 
 from siyuan_ai_companion.model.siyuan_api import SiyuanApi, SiYuanApiError
 
 
+pytestmark = [
+    pytest.mark.slow,
+    pytest.mark.remote,
+    pytest.mark.skipif(
+        not os.getenv('SIYUAN_URL'),
+        reason='SIYUAN_URL is not set, no SiYuan instance to test against',
+    ),
+]
+
+_T_2024 = datetime.datetime(2024, 1, 1)
+
+
+@pytest.fixture(scope='module')
+def siyuan_env():
+    """
+    The SiYuan URL and token configured for the integration environment
+    """
+    return os.getenv('SIYUAN_URL'), os.getenv('SIYUAN_TOKEN')
+
+
+@pytest_asyncio.fixture(scope='module')
+async def siyuan_client():
+    """
+    A SiyuanApi opened once and shared by the tests of this module
+    """
+    async with SiyuanApi() as siyuan:
+        yield siyuan
+
+
 class TestSiyuanApi:
-    def test_init(self):
+    def test_init(self, siyuan_env):
         siyuan = SiyuanApi()
 
-        siyuan_url = os.getenv('SIYUAN_URL')
-        siyuan_token = os.getenv('SIYUAN_TOKEN')
+        siyuan_url, siyuan_token = siyuan_env
 
         assert siyuan.url == siyuan_url
         assert siyuan.token == siyuan_token
@@ -30,17 +59,15 @@ class TestSiyuanApi:
         assert siyuan._client.base_url == 'https://example.com'
         assert siyuan._client.headers['Authorization'] == 'Token test_token'
 
-    async def test_aenter(self):
-        async with SiyuanApi() as siyuan:
-            siyuan_url = os.getenv('SIYUAN_URL')
-            siyuan_token = os.getenv('SIYUAN_TOKEN')
+    async def test_aenter(self, siyuan_client, siyuan_env):
+        siyuan_url, siyuan_token = siyuan_env
 
-            assert siyuan.url == siyuan_url
-            assert siyuan.token == siyuan_token
-            assert siyuan._client.base_url == siyuan_url
+        assert siyuan_client.url == siyuan_url
+        assert siyuan_client.token == siyuan_token
+        assert siyuan_client._client.base_url == siyuan_url
 
-            if siyuan_token is not None:
-                assert siyuan._client.headers['Authorization'] == f'Token {siyuan_token}'
+        if siyuan_token is not None:
+            assert siyuan_client._client.headers['Authorization'] == f'Token {siyuan_token}'
 
     async def test_close(self):
         siyuan = SiyuanApi()
@@ -51,74 +78,68 @@ class TestSiyuanApi:
 
         assert siyuan._client.is_closed
 
-    async def test_raw_query(self):
-        async with SiyuanApi() as siyuan:
-            payload = await siyuan._raw_query(
-                sql_query='SELECT COUNT(*) FROM blocks',
-            )
+    async def test_raw_query(self, siyuan_client):
+        payload = await siyuan_client._raw_query(
+            sql_query='SELECT COUNT(*) FROM blocks',
+        )
 
-            assert isinstance(payload[0]['COUNT(*)'], int)
+        assert isinstance(payload[0]['COUNT(*)'], int)
 
-            with pytest.raises(SiYuanApiError):
-                await siyuan._raw_query(
-                    sql_query='MALFORMED SQL QUERY',
-                )
+        with pytest.raises(SiYuanApiError):
+            await siyuan_client._raw_query(
+                sql_query='MALFORMED SQL QUERY',
+            )
 
-    async def test_get_count(self):
-        async with SiyuanApi() as siyuan:
-            count = await siyuan.get_count()
+    async def test_get_count(self, siyuan_client):
+        count = await siyuan_client.get_count()
 
-            assert isinstance(count, int)
-            assert count == siyuan._block_count
+        assert isinstance(count, int)
+        assert count == siyuan_client._block_count
 
-    async def test_get_block(self):
-        async with SiyuanApi() as siyuan:
-            block_id = os.getenv('SIYUAN_TEST_BLOCK_ID')
+    async def test_get_block(self, siyuan_client):
+        block_id = os.getenv('SIYUAN_TEST_BLOCK_ID')
 
-            payload = await siyuan.get_block(
-                block_id=block_id,
-            )
+        payload = await siyuan_client.get_block(
+            block_id=block_id,
+        )
 
-            assert isinstance(payload, dict)
-            assert payload['id'] == block_id
+        assert isinstance(payload, dict)
+        assert payload['id'] == block_id
 
-    async def test_get_blocks_by_time(self):
-        async with SiyuanApi() as siyuan:
-            all_blocks = await siyuan.get_blocks_by_time()
+    async def test_get_blocks_by_time(self, siyuan_client):
+        all_blocks = await siyuan_client.get_blocks_by_time()
 
-            assert isinstance(all_blocks, list)
-            assert len(all_blocks) > 0
+        assert isinstance(all_blocks, list)
+        assert len(all_blocks) > 0
 
-            partial_blocks = await siyuan.get_blocks_by_time(
-                updated_after=datetime.datetime(2024, 1, 1)
-            )
+        partial_blocks = await siyuan_client.get_blocks_by_time(
+            updated_after=_T_2024
+        )
 
-            assert isinstance(partial_blocks, list)
-            assert len(partial_blocks) > 0
+        assert isinstance(partial_blocks, list)
+        assert len(partial_blocks) > 0
 
-            assert len(all_blocks) > len(partial_blocks)
+        assert len(all_blocks) > len(partial_blocks)
 
-    async def test_get_blocks_by_note(self):
-        async with SiyuanApi() as siyuan:
-            note_id = os.getenv('SIYUAN_TEST_NOTE_ID')
+    async def test_get_blocks_by_note(self, siyuan_client):
+        note_id = os.getenv('SIYUAN_TEST_NOTE_ID')
 
-            payload = await siyuan.get_blocks_by_note(
-                note_id=note_id,
-            )
+        payload = await siyuan_client.get_blocks_by_note(
+            note_id=note_id,
+        )
 
-            assert isinstance(payload, list)
-            assert len(payload) > 0
+        assert isinstance(payload, list)
+        assert len(payload) > 0
 
-            for block in payload:
-                assert block['root_id'] == note_id
+        for block in payload:
+            assert block['root_id'] == note_id
 
-    async def test_get_note_plaintext(self):
-        async with SiyuanApi() as siyuan:
-            note_id = os.getenv('SIYUAN_TEST_NOTE_ID')
+    async def test_get_note_plaintext(self, siyuan_client):
+        note_id = os.getenv('SIYUAN_TEST_NOTE_ID')
 
-            plaintext = await siyuan.get_note_plaintext(
-                note_id=note_id,
-            )
+        plaintext = await siyuan_client.get_note_plaintext(
+            note_id=note_id,
+        )
 
-            assert isinstance(plaintext, str)
-            assert len(plaintext) > 0
+        assert isinstance(plaintext, str)
+        assert len(plaintext) > 0
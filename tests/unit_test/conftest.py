@@ -0,0 +1,88 @@
+from dataclasses import dataclass
+from unittest.mock import AsyncMock, Mock, patch
+import pytest
+
+from siyuan_ai_companion.model.rag_driver import RagDriver
+from siyuan_ai_companion.model.siyuan_api import SiyuanApi
+
+
+_EMBED = [0.1, 0.2, 0.3]
+
+
+class _FakeTensor:
+    """
+    Stands in for the tensor returned by SentenceTransformer.encode
+    """
+    tolist = staticmethod(lambda: _EMBED)
+
+
+@dataclass
+class RagMocks:
+    """
+    The mocks patched into RagDriver for a single test
+    """
+    client: Mock
+    transformer: Mock
+
+
+@pytest.fixture(scope='session')
+def mock_async_client():
+    """
+    A mocked httpx client, shared by the whole session
+    """
+    return AsyncMock()
+
+
+@pytest.fixture
+def siyuan_api(mock_async_client):     # pylint: disable=redefined-outer-name
+    """
+    A fresh SiyuanApi for one test, backed by the shared mocked httpx client
+
+    Avoids building a real AsyncClient (and its SSL context) in every test,
+    while instance state such as the cached block count starts over.
+    """
+    return SiyuanApi(client=mock_async_client)
+
+
+@pytest.fixture(scope='session')
+def rag_backend():
+    """
+    Keep RagDriver off a real model and Qdrant for the whole session
+
+    The client and transformer are class attributes, so tests can still patch
+    them with their own mocks to assert on the calls.
+    """
+    transformer = Mock()
+    transformer.get_sentence_embedding_dimension.return_value = 3
+
+    with patch.object(RagDriver, 'client', Mock()), \
+            patch.object(RagDriver, 'transformer', transformer):
+        yield
+
+
+@pytest.fixture
+def rag_driver(rag_backend):     # pylint: disable=unused-argument,redefined-outer-name
+    """
+    A fresh RagDriver for one test, so attributes can simply be assigned on it
+    """
+    return RagDriver()
+
+
+@pytest.fixture
+def rag_mocks(mocker, rag_driver):
+    """
+    Fresh Qdrant client and transformer mocks for RagDriver, for one test
+
+    The transformer encodes every text into the same small embedding.
+    """
+    mocks = RagMocks(
+        client=mocker.Mock(),
+        transformer=mocker.Mock(),
+    )
+    mocks.transformer.encode.return_value = _FakeTensor
+    mocks.transformer.get_sentence_embedding_dimension.return_value = 3
+
+    mocker.patch.object(RagDriver, 'client', mocks.client)
+    mocker.patch.object(RagDriver, 'transformer', mocks.transformer)
+
+    return mocks
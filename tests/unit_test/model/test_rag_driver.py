@@ -1,111 +1,96 @@
-from unittest.mock import AsyncMock
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, Mock
+import pytest
 from qdrant_client.http.models import ScoredPoint
-from siyuan_ai_companion.model.rag_driver import RagDriver
 
 
+_SCORED_HIT = ScoredPoint(
+    id=1,
+    score=0.9,
+    payload={'blockId': 'block1', 'documentId': 'doc1', 'content': 'test content'},
+    version=0
+)
+_HITS = SimpleNamespace(points=[_SCORED_HIT])
+_NOTE_CONTENT = {
+    'doc1': 'Document 1 content.',
+    'doc2': 'Document 2 content.',
+}
+_NOTE_MARKDOWN = {
+    'doc1': '# Doc 1\nContent 1',
+    'doc2': '# Doc 2\nContent 2',
+}
+_DOC_HEADERS = '# Header 1\nContent 1\n\n## Header 2\nContent 2'
+_DOC_PARAGRAPHS = 'Paragraph 1\n\nParagraph 2'
+_DOC_LONG = 'Paragraph 1\n\nParagraph 2\n\nParagraph 3'
+
+
+class _acm:     # pylint: disable=invalid-name
+    """
+    A minimal async context manager yielding the given object, standing in for SiyuanApi
+    """
+    def __init__(self, inner):
+        self._inner = inner
+
+    async def __aenter__(self):
+        return self._inner
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        return None
+
+
+@pytest.fixture
+def driver_with_token_est(rag_driver):
+    """
+    A fresh RagDriver with a token estimate large enough to force segmentation
+    """
+    rag_driver._estimate_tokens = Mock(return_value=1000)
+    return rag_driver
+
+
+@pytest.mark.local
+@pytest.mark.xdist_group('rag_driver')
 class TestRagDriver:
-    def test_add_single_block_to_index(self, mocker):
-        mock_client = mocker.Mock()
-        mock_transformer = mocker.Mock()
-        mock_tensor = mocker.Mock()
-        mock_tensor.tolist.return_value = [0.1, 0.2, 0.3]
-        mock_transformer.encode.return_value = mock_tensor
-        mocker.patch.object(RagDriver, 'client', mock_client)
-        mocker.patch.object(RagDriver, 'transformer', mock_transformer)
-
-        driver = RagDriver()
-        driver.add_block('block1', 'doc1', 'test content')
-
-        mock_client.upsert.assert_called_once()
-
-    def test_add_multiple_blocks_to_index(self, mocker):
-        mock_client = mocker.Mock()
-        mock_transformer = mocker.Mock()
-        mock_tensor = mocker.Mock()
-        mock_tensor.tolist.return_value = [0.1, 0.2, 0.3]
-        mock_transformer.encode.return_value = mock_tensor
-        mocker.patch.object(RagDriver, 'client', mock_client)
-        mocker.patch.object(RagDriver, 'transformer', mock_transformer)
-
-        driver = RagDriver()
-        driver.add_blocks([
+    def test_add_single_block_to_index(self, rag_mocks, rag_driver):
+        rag_driver.add_block('block1', 'doc1', 'test content')
+
+        rag_mocks.client.upsert.assert_called_once()
+
+    def test_add_multiple_blocks_to_index(self, rag_mocks, rag_driver):
+        rag_driver.add_blocks([
             ('block1', 'test content 1', 'doc1'),
             ('block2', 'test content 2', 'doc2')
         ])
 
-        mock_client.upsert.assert_called_once()
-
-    def test_update_single_block_in_index(self, mocker):
-        mock_client = mocker.Mock()
-        mock_transformer = mocker.Mock()
-        mock_tensor = mocker.Mock()
-        mock_tensor.tolist.return_value = [0.1, 0.2, 0.3]
-        mock_transformer.encode.return_value = mock_tensor
-        mocker.patch.object(RagDriver, 'client', mock_client)
-        mocker.patch.object(RagDriver, 'transformer', mock_transformer)
-
-        driver = RagDriver()
-        driver.update_block('block1', 'doc1', 'updated content')
-
-        mock_client.upsert.assert_called_once()
-
-    def test_update_multiple_blocks_in_index(self, mocker):
-        mock_client = mocker.Mock()
-        mock_transformer = mocker.Mock()
-        mock_tensor = mocker.Mock()
-        mock_tensor.tolist.return_value = [0.1, 0.2, 0.3]
-        mock_transformer.encode.return_value = mock_tensor
-        mocker.patch.object(RagDriver, 'client', mock_client)
-        mocker.patch.object(RagDriver, 'transformer', mock_transformer)
-
-        driver = RagDriver()
-        driver.update_blocks([
+        rag_mocks.client.upsert.assert_called_once()
+
+    def test_update_single_block_in_index(self, rag_mocks, rag_driver):
+        rag_driver.update_block('block1', 'doc1', 'updated content')
+
+        rag_mocks.client.upsert.assert_called_once()
+
+    def test_update_multiple_blocks_in_index(self, rag_mocks, rag_driver):
+        rag_driver.update_blocks([
             ('block1', 'updated content 1', 'doc1'),
             ('block2', 'updated content 2', 'doc2')
         ])
 
-        mock_client.upsert.assert_called_once()
-
-    def test_delete_single_block_from_index(self, mocker):
-        mock_client = mocker.Mock()
-        mocker.patch.object(RagDriver, 'client', mock_client)
-
-        driver = RagDriver()
-        driver.delete_block('block1')
-
-        mock_client.delete.assert_called_once()
-
-    def test_delete_all_blocks_from_index(self, mocker):
-        mock_client = mocker.Mock()
-        mocker.patch.object(RagDriver, 'client', mock_client)
-
-        driver = RagDriver()
-        driver.delete_all()
-
-        mock_client.delete_collection.assert_called_once()
-        mock_client.create_collection.assert_called_once()
-
-    def test_search_for_relevant_blocks(self, mocker):
-        mock_client = mocker.Mock()
-        mock_transformer = mocker.Mock()
-        mock_tensor = mocker.Mock()
-        mock_tensor.tolist.return_value = [0.1, 0.2, 0.3]
-        mock_transformer.encode.return_value = mock_tensor
-        mock_hits = mocker.Mock()
-        mock_hits.points = [
-            ScoredPoint(
-                id=1,
-                score=0.9,
-                payload={'blockId': 'block1', 'documentId': 'doc1', 'content': 'test content'},
-                version=0
-            )
-        ]
-        mock_client.query_points.return_value = mock_hits
-        mocker.patch.object(RagDriver, 'client', mock_client)
-        mocker.patch.object(RagDriver, 'transformer', mock_transformer)
-
-        driver = RagDriver()
-        results = driver.search('query')
+        rag_mocks.client.upsert.assert_called_once()
+
+    def test_delete_single_block_from_index(self, rag_mocks, rag_driver):
+        rag_driver.delete_block('block1')
+
+        rag_mocks.client.delete.assert_called_once()
+
+    def test_delete_all_blocks_from_index(self, rag_mocks, rag_driver):
+        rag_driver.delete_all()
+
+        rag_mocks.client.delete_collection.assert_called_once()
+        rag_mocks.client.create_collection.assert_called_once()
+
+    def test_search_for_relevant_blocks(self, rag_mocks, rag_driver):
+        rag_mocks.client.query_points.return_value = _HITS
+
+        results = rag_driver.search('query')
 
         assert results == [{
             'blockId': 'block1',
@@ -114,118 +99,79 @@ class TestRagDriver:
             'score': 0.9
         }]
 
-    async def test_build_prompt(self, mocker):
-        mock_client = mocker.Mock()
-        mock_transformer = mocker.Mock()
-        mock_tensor = mocker.Mock()
-        mock_tensor.tolist.return_value = [0.1, 0.2, 0.3]
-        mock_transformer.encode.return_value = mock_tensor
-
-        # Patch RagDriver internals
-        mocker.patch.object(RagDriver, 'client', mock_client)
-        mocker.patch.object(RagDriver, 'transformer', mock_transformer)
-
+    async def test_build_prompt_via_siyuan_cm(self, mocker, rag_mocks, rag_driver):
         # Mock search to return synthetic results
-        mock_driver = RagDriver()
-        mock_driver.search = mocker.Mock(return_value=[
+        rag_driver.search = Mock(return_value=[
             {'blockId': 'block1', 'documentId': 'doc1', 'content': 'Block 1 content'},
             {'blockId': 'block2', 'documentId': 'doc2', 'content': 'Block 2 content'},
         ])
 
         # Mock SiyuanApi async context manager
-        mock_siyuan = mocker.AsyncMock()
-        mock_siyuan.get_note_markdown.side_effect = [
-            'Document 1 content.',
-            'Document 2 content.',
-        ]
+        mock_siyuan = AsyncMock()
+        mock_siyuan.get_note_markdown.side_effect = lambda note_id: _NOTE_CONTENT[note_id]
 
-        mock_siyuan_cm = mocker.AsyncMock()
-        mock_siyuan_cm.__aenter__.return_value = mock_siyuan
-        mock_siyuan_cm.__aexit__.return_value = None
-
-        mocker.patch('siyuan_ai_companion.model.rag_driver.SiyuanApi', return_value=mock_siyuan_cm)
+        mocker.patch(
+            'siyuan_ai_companion.model.rag_driver.SiyuanApi',
+            return_value=_acm(mock_siyuan),
+        )
 
-        result = await mock_driver.build_prompt('What is AI?', limit=2)
+        result = await rag_driver.build_prompt('What is AI?', limit=2)
 
         assert 'Document 1 content.' in result
         assert 'Document 2 content.' in result
         assert 'What is AI?' in result
 
-    def test_segment_document_with_headers(self, mocker):
-        driver = RagDriver()
-
-        # Provide a large enough token size to force segmentation
-        mocker.patch.object(driver, '_estimate_tokens', return_value=1000)
-
-        document = "# Header 1\nContent 1\n\n## Header 2\nContent 2"
-        matching_blocks = ["Content 1", "Content 2"]
-
-        segments = driver._segment_document(document, matching_blocks)
+    def test_segment_document_with_headers(self, driver_with_token_est):
+        segments = driver_with_token_est._segment_document(
+            _DOC_HEADERS,
+            ["Content 1", "Content 2"],
+        )
         assert len(segments) == 2, segments
         assert "Content 1" in segments[0]
         assert "Content 2" in segments[1]
 
-    def test_segment_document_without_headers(self, mocker):
-        driver = RagDriver()
-
-        # Provide a large enough token size to force segmentation
-        mocker.patch.object(driver, '_estimate_tokens', return_value=1000)
-
-        document = "Paragraph 1\n\nParagraph 2"
-        matching_blocks = ["Paragraph 1"]
-
-        segments = driver._segment_document(document, matching_blocks)
+    def test_segment_document_without_headers(self, driver_with_token_est):
+        segments = driver_with_token_est._segment_document(_DOC_PARAGRAPHS, ["Paragraph 1"])
         assert len(segments) == 1, segments
         assert "Paragraph 1" in segments[0]
 
-    def test_fallback_split(self, mocker):
-        driver = RagDriver()
-        mocker.patch.object(driver, '_estimate_tokens', side_effect=lambda x: len(x.split()))
-        driver._max_segment_tokens = 5
+    def test_fallback_split(self, rag_driver):
+        rag_driver._estimate_tokens = lambda x: len(x.split())
+        rag_driver._max_segment_tokens = 5
 
-        document = "Paragraph 1\n\nParagraph 2\n\nParagraph 3"
-        segments = driver._fallback_split(document)
+        segments = rag_driver._fallback_split(_DOC_LONG)
         assert len(segments) == 2, segments
         assert "Paragraph 1" in segments[0]
         assert "Paragraph 2" in segments[0]
         assert "Paragraph 3" in segments[1]
 
-    async def test_get_context(self, mocker):
-        driver = RagDriver()
-
+    async def test_get_context(self, mocker, rag_driver):
         # Patch the search method to return mock search results
-        mocker.patch.object(driver, 'search', return_value=[
+        rag_driver.search = Mock(return_value=[
             {'blockId': 'block1', 'documentId': 'doc1', 'content': 'Content 1'},
             {'blockId': 'block2', 'documentId': 'doc2', 'content': 'Content 2'}
         ])
 
-        # Create a mock SiyuanApi context manager
+        # Create a mock SiyuanApi instance
         mock_siyuan_instance = AsyncMock()
-        mock_siyuan_instance.get_note_markdown.side_effect = [
-            "# Doc 1\nContent 1", "# Doc 2\nContent 2"
-        ]
-
-        mock_siyuan_cm = AsyncMock()
-        mock_siyuan_cm.__aenter__.return_value = mock_siyuan_instance
-        mock_siyuan_cm.__aexit__.return_value = None
+        mock_siyuan_instance.get_note_markdown.side_effect = lambda note_id: _NOTE_MARKDOWN[note_id]
 
         # Patch the SiyuanApi class to return the mock context manager
         mocker.patch(
             'siyuan_ai_companion.model.rag_driver.SiyuanApi',
-            return_value=mock_siyuan_cm
+            return_value=_acm(mock_siyuan_instance),
         )
 
-        context = await driver.get_context("query", limit=2)
+        context = await rag_driver.get_context("query", limit=2)
         assert len(context) == 2
 
-    async def test_build_prompt(self, mocker):
-        driver = RagDriver()
-        mocker.patch.object(driver, 'get_context', return_value=[
+    async def test_build_prompt(self, rag_driver):
+        rag_driver.get_context = AsyncMock(return_value=[
             "Context 1",
             "Context 2"
         ])
 
-        prompt = await driver.build_prompt("What is AI?", limit=2)
+        prompt = await rag_driver.build_prompt("What is AI?", limit=2)
         assert "Context 1" in prompt
         assert "Context 2" in prompt
         assert "What is AI?" in prompt
@@ -1,167 +1,161 @@
+import os
 import pytest
+import httpx
 from datetime import datetime
-from httpx import AsyncClient
+from types import SimpleNamespace
 from siyuan_ai_companion.model.siyuan_api import SiyuanApi
 from siyuan_ai_companion.errors import SiYuanApiError
 
 
-class TestSiyuanApi:
+_T_2023 = datetime(2023, 1, 1)
+_SQL_COUNT = 'SELECT COUNT(*) FROM blocks'
+_COUNT_ROWS = [{'COUNT(*)': 5}]
+_BLOCK_ROWS = [{'id': 'block1', 'content': 'test content'}]
+_UPDATED_ROWS = [{'id': 'block1', 'updated': '20230101000000'}]
+_ASSET_FILES = ['/data/assets/file1.mp3', '/data/assets/file2.wav']
+_INSERT_RESULT = [{'doOperations': {'id': 'block_id_123'}, 'undoOperations': None}]
+_ASSET_RESPONSE = SimpleNamespace(
+    headers={'Content-Type': 'audio/mpeg'},
+    content=b'fake audio content',
+)
+
+
+def _stub(value):
     """
-    Test cases for SiyuanApi class
+    An async method that ignores its arguments and returns the given value
     """
+    async def method(self, *args, **kwargs):     # pylint: disable=unused-argument
+        return value
 
-    async def test_successful_sql_query(self, mocker):
-        """
-        Successful SQL query execution
-        """
-        mock_client = mocker.AsyncMock(spec=AsyncClient)
-        mock_response = mocker.Mock()
-        mock_response.status_code = 200
-        mock_response.json.return_value = {'code': 0, 'data': [{'COUNT(*)': 5}]}
-        mock_client.post.return_value = mock_response
+    return method
 
-        api = SiyuanApi(client=mock_client)
-        result = await api._raw_query("SELECT COUNT(*) FROM blocks")
-        assert result == [{'COUNT(*)': 5}]
 
-    async def test_failed_sql_query_with_status_code(self, mocker):
-        """
-        SQL query failed with a non-200 status code
-        """
-        mock_client = mocker.AsyncMock(spec=AsyncClient)
-        mock_response = mocker.Mock()
-        mock_response.status_code = 500
-        mock_response.json.return_value = {'error': 'Internal Server Error'}
-        mock_client.post.return_value = mock_response
+_QUERY_COUNT = _stub(_COUNT_ROWS)
+_QUERY_BLOCK = _stub(_BLOCK_ROWS)
+_QUERY_UPDATED = _stub(_UPDATED_ROWS)
+_LIST_ASSET_FILES = _stub(_ASSET_FILES)
+_POST_NOTE_ID = _stub('note_id_123')
+_POST_INSERT = _stub(_INSERT_RESULT)
+_POST_NOTHING = _stub(None)
+_POST_ASSET = _stub(_ASSET_RESPONSE)
+
+
+def _sql_client(status: int, payload: dict) -> httpx.AsyncClient:
+    """
+    An httpx client answering the SiYuan SQL endpoint in-process
+    """
+    def handler(request: httpx.Request) -> httpx.Response:
+        assert request.url.path == '/api/query/sql'
+        return httpx.Response(status, json=payload)
+
+    return httpx.AsyncClient(
+        base_url='http://siyuan.test',
+        transport=httpx.MockTransport(handler),
+    )
 
-        api = SiyuanApi(client=mock_client)
-        with pytest.raises(SiYuanApiError):
-            await api._raw_query("SELECT COUNT(*) FROM blocks")
 
-    async def test_failed_sql_query_with_json_code(self, mocker):
+@pytest.mark.local
+@pytest.mark.xdist_group('siyuan_api')
+class TestSiyuanApi:
+    """
+    Test cases for SiyuanApi class
+    """
+
+    @pytest.mark.parametrize('status, payload, expected', [
+        (200, {'code': 0, 'data': [{'COUNT(*)': 5}]}, [{'COUNT(*)': 5}]),
+        (500, {'error': 'Internal Server Error'}, SiYuanApiError),
+        (200, {'code': 1, 'msg': 'Error'}, SiYuanApiError),
+    ], ids=['success', 'http_error', 'json_error'])
+    async def test_sql_query(self, status, payload, expected):
         """
-        SQL query failed with 200 but an error code in response JSON
+        SQL query execution, failing on either a non-200 status code
+        or an error code in the response JSON
         """
-        mock_client = mocker.AsyncMock(spec=AsyncClient)
-        mock_response = mocker.Mock()
-        mock_response.status_code = 200
-        mock_response.json.return_value = {'code': 1, 'msg': 'Error'}
-        mock_client.post.return_value = mock_response
-
-        api = SiyuanApi(client=mock_client)
-        with pytest.raises(SiYuanApiError):
-            await api._raw_query("SELECT COUNT(*) FROM blocks")
+        async with SiyuanApi(client=_sql_client(status, payload)) as api:
+            if isinstance(expected, type) and issubclass(expected, Exception):
+                with pytest.raises(expected):
+                    await api._raw_query(_SQL_COUNT)
+            else:
+                result = await api._raw_query(_SQL_COUNT)
+                assert result == expected
 
-    async def test_retrieves_block_count(self, mocker):
+    async def test_retrieves_block_count(self, monkeypatch, siyuan_api):
         """
         Retrieves the block count from the database
         """
-        mocker.patch.object(SiyuanApi, '_raw_query', return_value=[{'COUNT(*)': 5}])
-        api = SiyuanApi()
-        result = await api.get_count()
+        monkeypatch.setattr(SiyuanApi, '_raw_query', _QUERY_COUNT)
+        result = await siyuan_api.get_count()
         assert result == 5
 
-    async def test_retrieves_block_by_id(self, mocker):
+    async def test_retrieves_block_by_id(self, monkeypatch, siyuan_api):
         """
         Retrieves a single block by its ID
         """
-        mocker.patch.object(
-            SiyuanApi,
-            '_raw_query',
-            return_value=[{'id': 'block1', 'content': 'test content'}]
-        )
-        api = SiyuanApi()
-        result = await api.get_block('block1')
+        monkeypatch.setattr(SiyuanApi, '_raw_query', _QUERY_BLOCK)
+        result = await siyuan_api.get_block('block1')
         assert result == {'id': 'block1', 'content': 'test content'}
 
-    async def test_retrieves_blocks_by_time(self, mocker):
+    async def test_retrieves_blocks_by_time(self, monkeypatch, siyuan_api):
         """
         Retrieve multiple blocks updated after a certain time
         """
-        mocker.patch.object(
-            SiyuanApi,
-            '_raw_query',
-            return_value=[{'id': 'block1', 'updated': '20230101000000'}]
-        )
-        mocker.patch.object(
-            SiyuanApi,
-            'get_count',
-            return_value=1
-        )
-        api = SiyuanApi()
-        api._block_count = 1
-        result = await api.get_blocks_by_time(
-            updated_after=datetime(2023, 1, 1)
+        monkeypatch.setattr(SiyuanApi, '_raw_query', _QUERY_UPDATED)
+        monkeypatch.setattr(siyuan_api, '_block_count', 1)
+        result = await siyuan_api.get_blocks_by_time(
+            updated_after=_T_2023
         )
         assert result == [{'id': 'block1', 'updated': '20230101000000'}]
 
-    async def test_list_assets(self, mocker):
+    async def test_list_assets(self, monkeypatch, siyuan_api):
         """
         List all assets with optional suffix filtering
         """
-        mocker.patch.object(
-            SiyuanApi,
-            '_list_files_recursive',
-            return_value=['/data/assets/file1.mp3', '/data/assets/file2.wav']
-        )
-        api = SiyuanApi()
-        result = await api.list_assets(suffixes=['.mp3'])
+        monkeypatch.setattr(SiyuanApi, '_list_files_recursive', _LIST_ASSET_FILES)
+        result = await siyuan_api.list_assets(suffixes=['.mp3'])
         assert result == ['file1.mp3']
 
-    async def test_create_note(self, mocker):
+    async def test_create_note(self, monkeypatch, siyuan_api):
         """
         Create a note in a notebook
         """
-        mocker.patch.object(
-            SiyuanApi,
-            '_raw_post',
-            return_value='note_id_123'
-        )
-        api = SiyuanApi()
-        result = await api.create_note(
+        monkeypatch.setattr(SiyuanApi, '_raw_post', _POST_NOTE_ID)
+        result = await siyuan_api.create_note(
             notebook_id='notebook1',
             path='/path/to/note',
             markdown_content='# Title\nContent'
         )
         assert result == 'note_id_123'
 
-    async def test_insert_block(self, mocker):
+    async def test_insert_block(self, monkeypatch, siyuan_api):
         """
         Insert a block into a note
         """
-        mocker.patch.object(
-            SiyuanApi,
-            '_raw_post',
-            return_value=[{'doOperations': {'id': 'block_id_123'}, 'undoOperations': None}]
-        )
-        api = SiyuanApi()
-        result = await api.insert_block(
+        monkeypatch.setattr(SiyuanApi, '_raw_post', _POST_INSERT)
+        result = await siyuan_api.insert_block(
             markdown_content='New block content',
             parent_id='parent_block_id'
         )
         assert result == 'block_id_123'
 
-    async def test_set_block_attribute(self, mocker):
+    async def test_set_block_attribute(self, monkeypatch, siyuan_api):
         """
         Set attributes for a block
         """
-        mocker.patch.object(SiyuanApi, '_raw_post', return_value=None)
-        api = SiyuanApi()
-        await api.set_block_attribute(
+        monkeypatch.setattr(SiyuanApi, '_raw_post', _POST_NOTHING)
+        await siyuan_api.set_block_attribute(
             block_id='block_id_123',
             attributes={'key': 'value'}
         )
 
-    async def test_download_asset(self, mocker):
+    @pytest.mark.limit_memory('8 MB')
+    async def test_download_asset(self, monkeypatch, siyuan_api):
         """
         Download an asset and store it as a temporary file
         """
-        mock_response = mocker.Mock()
-        mock_response.headers = {'Content-Type': 'audio/mpeg'}
-        mock_response.content = b'fake audio content'
-        mocker.patch.object(SiyuanApi, '_raw_post', return_value=mock_response)
+        monkeypatch.setattr(SiyuanApi, '_raw_post', _POST_ASSET)
 
-        api = SiyuanApi()
-        async with api.download_asset('path/to/asset.mp3') as temp_file:
+        async with siyuan_api.download_asset('path/to/asset.mp3') as temp_file:
             temp_file.seek(0)  # Ensure the file pointer is at the beginning
             assert temp_file.read() == b'fake audio content'
+            # Transcription reopens the asset by its path
+            assert os.path.isfile(temp_file.name)
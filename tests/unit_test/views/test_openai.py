@@ -0,0 +1,67 @@
+from io import BytesIO
+import pytest
+from quart import Quart
+from werkzeug.datastructures import FileStorage
+
+from siyuan_ai_companion.consts import APP_CONFIG
+from siyuan_ai_companion.views import openai_blueprint
+from siyuan_ai_companion.views.openai import _worth_rag
+
+
+class _ReadingTranscriber:
+    """
+    Stands in for Transcriber, reporting how much audio it could read
+    """
+    async def process_buffer(self, audio_buffer):
+        yield f'read {len(audio_buffer.read())} bytes'
+
+
+@pytest.fixture
+def openai_client(monkeypatch):
+    """
+    A test client for the OpenAI blueprint, without authentication
+    """
+    monkeypatch.setattr('siyuan_ai_companion.views.utils.EXPECTED_AUTH_HEADER', None)
+
+    app = Quart(__name__)
+    app.register_blueprint(openai_blueprint, url_prefix='/openai')
+
+    return app.test_client()
+
+
+@pytest.mark.local
+@pytest.mark.xdist_group('views')
+class TestOpenAiViews:
+    async def test_transcribe_reads_upload_after_view_returns(self, monkeypatch, openai_client):
+        """
+        The upload is still readable when the response streams, after
+        the request context (and its uploaded files) has been closed
+        """
+        monkeypatch.setattr('siyuan_ai_companion.views.openai.Transcriber', _ReadingTranscriber)
+
+        response = await openai_client.post(
+            '/openai/direct/v1/transcribe',
+            files={'file': FileStorage(BytesIO(b'\0' * 1000), filename='audio.wav')},
+        )
+
+        assert response.status_code == 200
+        assert await response.get_data() == b'read 1000 bytes'
+
+    @pytest.mark.parametrize('query', ['Who is Bob?', '量子计算是什么？', 'hi'])
+    def test_worth_rag_off_by_default(self, monkeypatch, query):
+        """
+        Every query is searched unless a minimum length is configured
+        """
+        monkeypatch.setattr(APP_CONFIG, 'rag_min_query_chars', 0)
+
+        assert _worth_rag(query)
+
+    def test_worth_rag_skips_short_queries_when_set(self, monkeypatch):
+        """
+        With a minimum length, short or repetitive queries skip retrieval
+        """
+        monkeypatch.setattr(APP_CONFIG, 'rag_min_query_chars', 12)
+
+        assert not _worth_rag('Who is Bob?')
+        assert not _worth_rag('aaaaaaaaaaaaaaaa')
+        assert _worth_rag('What did I write about Bob?')
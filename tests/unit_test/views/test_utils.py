@@ -0,0 +1,129 @@
+from types import SimpleNamespace
+import httpx
+import pytest
+from quart import Quart
+
+from siyuan_ai_companion.views.utils import forward_raw, forward_request
+
+
+_EVENTS = [f'data: {{"token": {i}}}\n\n'.encode() for i in range(5)]
+_AsyncClient = httpx.AsyncClient
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """
+    Route the httpx clients of the forwarding helpers to an in-process upstream
+
+    The upstream streams server-sent events one by one, recording each one
+    it sends into the returned log.
+    """
+    log = []
+    clients = []
+
+    async def events():
+        for event in _EVENTS:
+            log.append(('sent', event))
+            yield event
+
+    def handler(request: httpx.Request) -> httpx.Response:     # pylint: disable=unused-argument
+        return httpx.Response(
+            200,
+            headers={
+                'Content-Type': 'text/event-stream',
+                'X-Request-Id': 'req-1',
+                'Keep-Alive': 'timeout=5',
+            },
+            content=events(),
+        )
+
+    def client(**kwargs):
+        created = _AsyncClient(transport=httpx.MockTransport(handler), **kwargs)
+        clients.append(created)
+        return created
+
+    monkeypatch.setattr(httpx, 'AsyncClient', client)
+
+    return SimpleNamespace(log=log, clients=clients)
+
+
+@pytest.fixture
+def forwarding_context():
+    """
+    A request context for the forwarding helpers to read client headers from
+    """
+    return Quart(__name__).test_request_context('/', method='POST')
+
+
+async def _consume(response, log):
+    async with response.response as body:
+        async for chunk in body:
+            log.append(('received', chunk))
+
+
+@pytest.mark.local
+@pytest.mark.xdist_group('views')
+class TestForwarding:
+    async def test_forward_request_streams_events_as_they_arrive(self, upstream, forwarding_context):
+        """
+        Each streamed event reaches the client before the next one is sent
+        """
+        async with forwarding_context:
+            response = await forward_request(
+                'http://openai.test/v1/chat/completions',
+                {'stream': True},
+            )
+
+        await _consume(response, upstream.log)
+
+        assert upstream.log == [
+            step for event in _EVENTS for step in (('sent', event), ('received', event))
+        ]
+
+    async def test_forward_raw_streams_events_as_they_arrive(self, upstream, forwarding_context):
+        """
+        Raw forwarding relays each event before the next one is sent
+        """
+        async with forwarding_context:
+            response = await forward_raw(
+                'http://openai.test/v1/chat/completions',
+                b'{"stream": true}',
+                'application/json',
+            )
+
+        await _consume(response, upstream.log)
+
+        assert upstream.log == [
+            step for event in _EVENTS for step in (('sent', event), ('received', event))
+        ]
+
+    async def test_forward_raw_relays_status_and_headers(self, upstream, forwarding_context):
+        """
+        The upstream status and end-to-end headers reach the client,
+        hop-by-hop headers do not
+        """
+        async with forwarding_context:
+            response = await forward_raw(
+                'http://openai.test/v1/chat/completions',
+                b'{}',
+                'application/json',
+            )
+        await _consume(response, [])
+
+        assert response.status_code == 200
+        assert response.headers['Content-Type'] == 'text/event-stream'
+        assert response.headers['X-Request-Id'] == 'req-1'
+        assert 'Keep-Alive' not in response.headers
+
+    async def test_forward_raw_bounds_all_but_reading(self, upstream, forwarding_context):
+        """
+        A hung upstream cannot stall the request forever, while a long
+        stream is not cut off
+        """
+        async with forwarding_context:
+            response = await forward_raw('http://openai.test/v1/completions', b'{}', 'application/json')
+        await _consume(response, [])
+
+        timeout = upstream.clients[0].timeout
+        assert timeout.connect == timeout.write == timeout.pool == 30.0
+        assert timeout.read is None